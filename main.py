@@ -1,5 +1,7 @@
 from src.solvers.sa_solver import solve_vrp_sa
 from src.solvers.bab_solver import solve_vrp_bab
+from src.solvers.ml_sa_solver import MODEL_PATH, ENCODER_PATH
+from src.solvers.scenario_sweep import solve_traffic_scenarios
 from src.visualization import plot_routes
 import joblib
 import pandas as pd
@@ -74,18 +76,20 @@ def main():
         print("Incorrect choice!")
         return
     
+    adaptive = input("Use adaptive time limit with early stopping? (y/n): ").strip().lower() == "y"
+
     encoder, model = None, None
 
     if choice_alg in ["1"]:
         print("\nSolving with Simulated Annealing...")
-        route_nodes = solve_vrp_sa(time_csv, trips_file)
+        route_nodes = solve_vrp_sa(time_csv, trips_file, adaptive=adaptive)
     if choice_file != "1" and route_nodes is not None:
         print("\nPlotting routes...")
         plot_routes(route_nodes, location="Marzahn-Hellersdorf, Berlin, Germany")
 
     if choice_alg in ["2"]:
         print("\nSolving with Branch and Bound...")
-        route_nodes = solve_vrp_bab(time_csv, trips_file)
+        route_nodes = solve_vrp_bab(time_csv, trips_file, adaptive=adaptive)
         if choice_file != "1" and route_nodes is not None:
             print("\nPlotting routes...")
             plot_routes(route_nodes, location="Marzahn-Hellersdorf, Berlin, Germany")
@@ -93,13 +97,25 @@ def main():
     if choice_alg in ["3"]:
         print("\nSolving with SA and delay prediction...")
         print("Loading model and encoder for 'Time of Day'...")
-        model = joblib.load("src/RFR model/delay_prediction_model.pkl")
-        encoder = joblib.load("src/RFR model/time_of_day_encoder.pkl")
+        model = joblib.load(MODEL_PATH)
+        encoder = joblib.load(ENCODER_PATH)
         traffic_map = {'1': 'low', '2': 'moderate', '3': 'heavy'}
-        traffic_input = input("Introduce the traffic level: 1 - low, 2 - moderate, 3 - heavy: ").strip()
+        traffic_input = input("Introduce the traffic level: 1 - low, 2 - moderate, 3 - heavy, 4 - compare all: ").strip()
+        if traffic_input == "4":
+            print("\nSolving all traffic scenarios in parallel...")
+            _, comparison = solve_traffic_scenarios(time_csv, trips_file, model, encoder, adaptive=adaptive)
+            unsolved = comparison.columns[comparison.loc['Max'].isna()].tolist()
+            if len(unsolved) == len(comparison.columns):
+                print("\nNo solution found for any traffic level.")
+                return
+            print("\nRoute times per traffic level [min]:")
+            print(comparison.to_string())
+            if unsolved:
+                print(f"No solution found for: {', '.join(unsolved)}")
+            return
         traffic_level = traffic_map[traffic_input]
 
-        route_nodes = solve_vrp_sa(time_csv, trips_file, traffic_level, model, encoder)
+        route_nodes = solve_vrp_sa(time_csv, trips_file, traffic_level, model, encoder, adaptive=adaptive)
         if choice_file != "1" and route_nodes is not None:
             print("\nPlotting routes...")
             plot_routes(route_nodes, location="Marzahn-Hellersdorf, Berlin, Germany")
@@ -0,0 +1,498 @@
+"""
+Long-running local solver service.
+
+Keeps the delay model, the 'time of day' encoder and the parsed CSV matrices in the
+memory of a bounded pool of worker processes (and optionally the OSM graph in the
+service process), so solve requests do not pay the start-up and loading costs.
+
+Run from the repository root:
+    python -m src.service --port 8765 --workers 2
+    python -m src.service --unix-socket /tmp/vrp.sock
+
+Endpoints:
+- POST /solve   - solve request as JSON, see parse_job()
+- GET /metrics  - queue depth, request counters, latency percentiles and pool health
+- GET /health   - liveness and worker pool health check
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+import joblib
+import numpy as np
+
+from src.solvers.sa_solver import solve_vrp_sa
+from src.solvers.bab_solver import solve_vrp_bab
+from src.solvers.ml_sa_solver import (
+    MODEL_PATH, ENCODER_PATH, TRAFFIC_LEVELS, build_scenario_matrices, solve_vrp_with_predictions
+)
+from src.solvers.solver_utils import create_data_model, read_csv_cached
+
+ALGORITHMS = ('sa', 'bab', 'sa_delay', 'ml_sa')
+
+DEFAULT_DEADLINE = 120
+# Time reserved for building the model and returning the result
+DEADLINE_MARGIN = 1
+# Largest accepted request body
+MAX_BODY_BYTES = 1 << 20
+
+HTTP_REASONS = {
+    200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+    413: 'Payload Too Large', 422: 'Unprocessable Entity', 500: 'Internal Server Error',
+    503: 'Service Unavailable', 504: 'Gateway Timeout',
+}
+
+# Worker process state, filled in by _init_worker()
+_model = None
+_encoder = None
+
+
+def _init_worker(model_path, encoder_path, preload_files):
+    """
+    Loads the delay model and encoder once per worker process and warms the CSV cache.
+    """
+    global _model, _encoder
+    _model = joblib.load(model_path)
+    _encoder = joblib.load(encoder_path)
+    for time_csv, trips_file in preload_files:
+        create_data_model(time_csv, trips_file)
+
+
+@lru_cache(maxsize=32)
+def _delay_matrix(time_csv, mtime, traffic_level):
+    """
+    Returns the time matrix adjusted with the delays predicted for a traffic level.
+    Predictions are batched and memoized per worker until the matrix file changes.
+    """
+    time_matrix = read_csv_cached(time_csv, index_col=0).values
+    return build_scenario_matrices(time_matrix, [traffic_level], _model, _encoder)[traffic_level]
+
+
+def _solve(job):
+    """
+    Runs a single solve request inside a worker process.
+
+    Parameters:
+    - job (dict): Validated request, see parse_job().
+
+    Returns:
+    - dict or None: Stop coordinates for each route, None if no solution was found.
+    """
+    algorithm = job['algorithm']
+    time_csv, trips_file = job['time_csv'], job['trips_file']
+
+    if algorithm == 'sa':
+        return solve_vrp_sa(time_csv, trips_file, adaptive=job['adaptive'],
+                            max_time_limit=job['time_limit'])
+    if algorithm == 'bab':
+        return solve_vrp_bab(time_csv, trips_file, adaptive=job['adaptive'],
+                             max_time_limit=job['time_limit'])
+    if algorithm == 'sa_delay':
+        time_matrix = _delay_matrix(time_csv, os.path.getmtime(time_csv), job['traffic_level'])
+        return solve_vrp_sa(time_csv, trips_file, time_matrix=time_matrix,
+                            adaptive=job['adaptive'], max_time_limit=job['time_limit'])
+    # at least one second per round, all rounds within the request budget
+    rounds = min(job['rounds'], job['time_limit'])
+    return solve_vrp_with_predictions(
+        time_csv, trips_file, job['traffic_csv'], _model, _encoder,
+        rounds=rounds, time_limit=job['time_limit'] // rounds
+    )
+
+
+def parse_job(payload, default_deadline=DEFAULT_DEADLINE):
+    """
+    Validates a solve request.
+
+    Request fields:
+    - time_csv, trips_file (str): Paths to the time matrix and trips CSV files (required).
+    - algorithm (str): 'sa' (default), 'bab', 'sa_delay' or 'ml_sa'.
+    - traffic_level (str): 'low', 'moderate' or 'heavy', required for 'sa_delay'.
+    - traffic_csv (str): Per-arc traffic matrix for 'ml_sa' (optional).
+    - rounds (int): Prediction rounds for 'ml_sa' (default 1).
+    - adaptive (bool): Adaptive time limit with early stopping (default true).
+    - deadline (float): Seconds from submission until the request is abandoned.
+    - osm_nodes (bool): Also return the nearest OSM node of each stop (default false).
+
+    Returns:
+    - dict: Validated job.
+
+    Raises:
+    - ValueError: If the request is invalid.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("Request body must be a JSON object")
+
+    job = {
+        'algorithm': payload.get('algorithm', 'sa'),
+        'time_csv': payload.get('time_csv'),
+        'trips_file': payload.get('trips_file'),
+        'traffic_level': payload.get('traffic_level'),
+        'traffic_csv': payload.get('traffic_csv'),
+        'rounds': payload.get('rounds', 1),
+        'adaptive': payload.get('adaptive', True),
+        'deadline': payload.get('deadline', default_deadline),
+        'osm_nodes': payload.get('osm_nodes', False),
+    }
+
+    if job['algorithm'] not in ALGORITHMS:
+        raise ValueError(f"Unknown algorithm: {job['algorithm']}, expected one of {ALGORITHMS}")
+    for key in ('time_csv', 'trips_file') + (('traffic_csv',) if job['traffic_csv'] else ()):
+        if not isinstance(job[key], str) or not os.path.isfile(job[key]):
+            raise ValueError(f"File not found for '{key}': {job[key]}")
+    if job['algorithm'] == 'sa_delay' and job['traffic_level'] not in TRAFFIC_LEVELS:
+        raise ValueError(f"'traffic_level' must be one of {TRAFFIC_LEVELS}")
+    if isinstance(job['rounds'], bool) or not isinstance(job['rounds'], int) or job['rounds'] < 1:
+        raise ValueError("'rounds' must be a positive integer")
+    if (isinstance(job['deadline'], bool) or not isinstance(job['deadline'], (int, float))
+            or job['deadline'] <= 0):
+        raise ValueError("'deadline' must be a positive number of seconds")
+    for key in ('adaptive', 'osm_nodes'):
+        if not isinstance(job[key], bool):
+            raise ValueError(f"'{key}' must be true or false")
+    return job
+
+
+class SolverService:
+    """
+    Queues solve requests and runs them on a bounded process pool.
+
+    Parameters:
+    - workers (int): Number of worker processes.
+    - queue_size (int): Maximum number of requests waiting for a worker.
+    - default_deadline (float): Deadline for requests that do not set one.
+    - model_path, encoder_path (str): Delay model and encoder loaded by each worker.
+    - preload_files (list): (time_csv, trips_file) pairs parsed by each worker at start-up.
+    - location (str): Area whose OSM graph is kept in memory, None to skip it.
+    - latency_window (int): Number of recent requests used for latency percentiles,
+      requests answered with 504 included.
+    """
+
+    def __init__(self, workers=2, queue_size=16, default_deadline=DEFAULT_DEADLINE,
+                 model_path=MODEL_PATH, encoder_path=ENCODER_PATH, preload_files=(),
+                 location=None, latency_window=1000):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.default_deadline = default_deadline
+        self.model_path = model_path
+        self.encoder_path = encoder_path
+        self.preload_files = [tuple(files) for files in preload_files]
+        self.location = location
+
+        self.executor = None
+        self.queue = None
+        self.dispatchers = []
+        self.graph = None
+
+        self.started_at = time.monotonic()
+        self.running = 0
+        self.counters = {'completed': 0, 'no_solution': 0, 'failed': 0, 'rejected': 0, 'timed_out': 0}
+        self.latencies = deque(maxlen=latency_window)
+        self.pool_restarts = 0
+        self.pool_error = None
+
+    async def start(self):
+        """
+        Starts the worker pool and the dispatchers, loads the OSM graph if requested.
+        """
+        loop = asyncio.get_running_loop()
+        self.executor = self._create_executor()
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.dispatchers = [asyncio.create_task(self._dispatch()) for _ in range(self.workers)]
+
+        if self.location:
+            from src.visualization import load_graph
+            self.graph = await loop.run_in_executor(None, load_graph, self.location)
+
+    def _create_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(self.model_path, self.encoder_path, self.preload_files),
+        )
+
+    def _restart_pool(self, broken_executor):
+        """
+        Replaces a pool broken by a dead worker process (OOM, native crash).
+        Dispatchers that hit the same broken pool restart it only once.
+        """
+        if self.executor is not broken_executor:
+            return
+        broken_executor.shutdown(wait=False, cancel_futures=True)
+        try:
+            self.executor = self._create_executor()
+        except Exception as error:
+            self.pool_error = f"{type(error).__name__}: {error}"
+            raise
+        self.pool_restarts += 1
+        self.pool_error = None
+
+    def _submit_to_pool(self, loop, job):
+        if self.pool_error is not None:
+            # the last restart failed, try again
+            self._restart_pool(self.executor)
+        executor = self.executor
+        try:
+            return executor, loop.run_in_executor(executor, _solve, job)
+        except BrokenProcessPool:
+            # broken by an earlier request, not by this one
+            self._restart_pool(executor)
+            return self.executor, loop.run_in_executor(self.executor, _solve, job)
+
+    async def close(self):
+        """
+        Stops the dispatchers and shuts the worker pool down.
+        """
+        for dispatcher in self.dispatchers:
+            dispatcher.cancel()
+        await asyncio.gather(*self.dispatchers, return_exceptions=True)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def submit(self, payload):
+        """
+        Validates and queues a solve request, then waits for its result.
+
+        Returns:
+        - (int, dict): HTTP status and response body.
+        """
+        try:
+            job = parse_job(payload, self.default_deadline)
+        except ValueError as error:
+            return 400, {'error': str(error)}
+
+        loop = asyncio.get_running_loop()
+        job['submitted_at'] = loop.time()
+        job['deadline_at'] = job['submitted_at'] + job['deadline']
+        future = loop.create_future()
+        try:
+            self.queue.put_nowait((job, future))
+        except asyncio.QueueFull:
+            self.counters['rejected'] += 1
+            return 503, {'error': 'Queue is full', 'queue_depth': self.queue.qsize()}
+        return await future
+
+    async def _dispatch(self):
+        """
+        Moves queued requests to the pool, one at a time per worker.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            job, future = await self.queue.get()
+            try:
+                result = await self._run(loop, job, future)
+            except Exception as error:
+                self.counters['failed'] += 1
+                result = 500, {'error': f"{type(error).__name__}: {error}"}
+            finally:
+                self.queue.task_done()
+            if not future.done():
+                future.set_result(result)
+
+    async def _run(self, loop, job, future):
+        """
+        Runs a single request on the pool.
+        A request that misses its deadline is answered with 504 right away, while the
+        dispatcher keeps the worker slot until the solver actually returns.
+
+        Returns:
+        - (int, dict): HTTP status and response body.
+        """
+        started_at = loop.time()
+        remaining = job['deadline_at'] - started_at
+        if remaining <= DEADLINE_MARGIN:
+            self.counters['timed_out'] += 1
+            self.latencies.append(started_at - job['submitted_at'])
+            return 504, {'error': 'Deadline expired while queued'}
+
+        # Budget for the whole solver call, including every BaB pass
+        job['time_limit'] = max(1, int(remaining - DEADLINE_MARGIN))
+        self.running += 1
+        executor, pool_future = self._submit_to_pool(loop, job)
+        try:
+            route_nodes = await asyncio.wait_for(asyncio.shield(pool_future), remaining)
+        except asyncio.TimeoutError:
+            self.counters['timed_out'] += 1
+            self.latencies.append(loop.time() - job['submitted_at'])
+            if not future.done():
+                future.set_result((504, {'error': 'Deadline expired while solving'}))
+            result, = await asyncio.gather(pool_future, return_exceptions=True)
+            if isinstance(result, BrokenProcessPool):
+                self._restart_pool(executor)
+            return 504, {'error': 'Deadline expired while solving'}
+        except BrokenProcessPool:
+            self.counters['failed'] += 1
+            self._restart_pool(executor)
+            return 500, {'error': 'Worker process died; the worker pool was restarted'}
+        finally:
+            self.running -= 1
+
+        finished_at = loop.time()
+        self.latencies.append(finished_at - job['submitted_at'])
+        timing = {
+            'queue_ms': round((started_at - job['submitted_at']) * 1000, 1),
+            'solve_ms': round((finished_at - started_at) * 1000, 1),
+        }
+        if route_nodes is None:
+            self.counters['no_solution'] += 1
+            return 422, {'error': 'No solution found', **timing}
+
+        self.counters['completed'] += 1
+        body = {'route_nodes': route_nodes, **timing}
+        if job['osm_nodes'] and self.graph is not None:
+            from src.visualization import nearest_route_nodes
+            body['osm_nodes'] = await loop.run_in_executor(None, nearest_route_nodes, self.graph, route_nodes)
+        return 200, body
+
+    def metrics(self):
+        """
+        Returns queue depth, request counters, pool health and latency percentiles in milliseconds.
+        """
+        latency = {}
+        if self.latencies:
+            p50, p90, p99 = np.percentile(np.asarray(self.latencies) * 1000, [50, 90, 99])
+            latency = {'p50': round(float(p50), 1), 'p90': round(float(p90), 1), 'p99': round(float(p99), 1)}
+        return {
+            'pool': self.pool_health(),
+            'queue_depth': self.queue.qsize() if self.queue is not None else 0,
+            'queue_size': self.queue_size,
+            'running': self.running,
+            'workers': self.workers,
+            'uptime_s': round(time.monotonic() - self.started_at, 1),
+            'osm_graph_loaded': self.graph is not None,
+            'latency_ms': latency,
+            **self.counters,
+        }
+
+    def pool_health(self):
+        """
+        Returns the worker pool state: healthy flag, restart count and last restart error.
+        """
+        return {
+            'healthy': self.executor is not None and self.pool_error is None,
+            'restarts': self.pool_restarts,
+            'error': self.pool_error,
+        }
+
+    async def route(self, method, path, body):
+        """
+        Dispatches an HTTP request to the matching endpoint.
+
+        Returns:
+        - (int, dict): HTTP status and response body.
+        """
+        if path == '/health':
+            if method != 'GET':
+                return 405, {'error': 'Use GET'}
+            pool = self.pool_health()
+            return (200, {'status': 'ok', 'pool': pool}) if pool['healthy'] else (503, {'status': 'unhealthy', 'pool': pool})
+        if path == '/metrics':
+            return (200, self.metrics()) if method == 'GET' else (405, {'error': 'Use GET'})
+        if path == '/solve':
+            if method != 'POST':
+                return 405, {'error': 'Use POST'}
+            try:
+                payload = json.loads(body or b'{}')
+            except json.JSONDecodeError as error:
+                return 400, {'error': f"Invalid JSON: {error}"}
+            return await self.submit(payload)
+        return 404, {'error': f"Unknown path: {path}"}
+
+    async def handle(self, reader, writer):
+        """
+        Serves a single HTTP/1.1 request per connection.
+        """
+        try:
+            request_line = await reader.readline()
+            method, path, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', 0))
+            if length < 0:
+                raise ValueError("Negative Content-Length")
+            if length > MAX_BODY_BYTES:
+                status, payload = 413, {'error': f"Request body exceeds {MAX_BODY_BYTES} bytes"}
+            else:
+                body = await reader.readexactly(length)
+                status, payload = await self.route(method.upper(), path.split('?', 1)[0], body)
+        except (ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            status, payload = 400, {'error': 'Malformed HTTP request'}
+        except ConnectionError:
+            writer.close()
+            return
+
+        content = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        writer.write(
+            f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(content)}\r\n"
+            f"Connection: close\r\n\r\n".encode('latin-1') + content
+        )
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(args):
+    service = SolverService(
+        workers=args.workers,
+        queue_size=args.queue_size,
+        default_deadline=args.deadline,
+        model_path=args.model,
+        encoder_path=args.encoder,
+        preload_files=args.preload or (),
+        location=args.location,
+    )
+    await service.start()
+
+    if args.unix_socket:
+        server = await asyncio.start_unix_server(service.handle, path=args.unix_socket)
+        address = args.unix_socket
+    else:
+        server = await asyncio.start_server(service.handle, host=args.host, port=args.port)
+        address = f"http://{args.host}:{args.port}"
+    print(f"Solver service listening on {address} ({args.workers} workers, queue size {args.queue_size})")
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local VRP solver service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix-socket", help="Listen on a Unix socket instead of TCP.")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--queue-size", type=int, default=16)
+    parser.add_argument("--deadline", type=float, default=DEFAULT_DEADLINE,
+                        help="Default per-request deadline in seconds.")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--encoder", default=ENCODER_PATH)
+    parser.add_argument("--preload", nargs=2, action="append", metavar=("TIME_CSV", "TRIPS_FILE"),
+                        help="Matrices parsed by every worker at start-up (repeatable).")
+    parser.add_argument("--location", help="Keep the OSM graph of this area in memory.")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
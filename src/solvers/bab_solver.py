@@ -1,22 +1,34 @@
+import time
 from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
-from .solver_utils import create_data_model, print_solution
+from .solver_utils import (
+    create_data_model, print_solution, read_csv_cached,
+    adaptive_time_limit, ConvergenceMonitor, max_route_time_objective
+)
 import pandas as pd
 
-def solve_vrp_bab(time_csv, trips_file):
+def solve_vrp_bab(time_csv, trips_file, adaptive=False, stall_seconds=None, min_improvement=0.0,
+                  max_time_limit=None):
     """
     Rozwiązuje problem Vehicle Routing Problem z użyciem Google OR-Tools z Branch and Bound.
     Parametry:
     time_csv - plik z czasami tras
     dist_csv - plik z dystansami tras
     trips_file - plik z informacjami o przystankach
+    adaptive - limit czasu zależny od rozmiaru instancji i zatrzymanie po braku poprawy celu
+    stall_seconds - okno czasu bez poprawy celu (domyślnie 10% limitu czasu, min. 1 s)
+    min_improvement - minimalna względna poprawa celu uznawana za poprawę
+    max_time_limit - górne ograniczenie limitu czasu w sekundach (opcjonalne)
+
+    Domyślnie limit 150 s dotyczy każdego przebiegu. W trybie adaptacyjnym lub z max_time_limit
+    limit obejmuje całe wywołanie, a każdy przebieg dostaje tylko pozostały czas.
 
     Zwraca:
     route_nodes - lista wierzchołków trasy
     """
     data = create_data_model(time_csv, trips_file)
 
-    trips_df = pd.read_csv(trips_file)
+    trips_df = read_csv_cached(trips_file)
     stop_names = trips_df['stop_name'].tolist()
 
     manager = pywrapcp.RoutingIndexManager(
@@ -65,9 +77,32 @@ def solve_vrp_bab(time_csv, trips_file):
     search_parameters.local_search_metaheuristic = (
         routing_enums_pb2.LocalSearchMetaheuristic.SIMULATED_ANNEALING
     )
-    search_parameters.time_limit.seconds = 150
+    time_limit = 150
+    if adaptive:
+        time_limit = adaptive_time_limit(data['num_locations'], data['num_vehicles'])
+    if max_time_limit is not None:
+        time_limit = max(1, min(time_limit, int(max_time_limit)))
+    monitor = None
+    if adaptive:
+        if stall_seconds is None:
+            stall_seconds = max(1, time_limit // 10)
+        monitor = ConvergenceMonitor(
+            routing, max_route_time_objective(data, routing), stall_seconds, min_improvement
+        )
+    search_parameters.time_limit.seconds = time_limit
+    deadline = None
+    if adaptive or max_time_limit is not None:
+        deadline = time.monotonic() + time_limit
 
     while max_route_length > 0:
+        pass_limit = time_limit
+        if deadline is not None:
+            pass_limit = deadline - time.monotonic()
+            if pass_limit < 0.01:
+                print(f"Zakończenie wyszukiwania: wyczerpano łączny limit czasu {time_limit} s")
+                break
+            search_parameters.time_limit.FromMilliseconds(int(pass_limit * 1000))
+
         # stworzenie zmiennej do przechowywania maksymalnego czasu podrózy
         max_route_var = routing.solver().IntVar(0, max_route_length, "max_route_var")
 
@@ -80,7 +115,12 @@ def solve_vrp_bab(time_csv, trips_file):
         routing.solver().Minimize(max_route_var, 1)
 
         # Rozwiązanie problemu
+        if monitor is not None:
+            # kolejne przebiegi mają już rozwiązanie, więc mogą zakończyć się bez nowego
+            monitor.reset(armed=best_solution is not None)
         solution = routing.SolveWithParameters(search_parameters)
+        if monitor is not None:
+            print(f"Zakończenie wyszukiwania: {monitor.stop_reason(pass_limit)}")
 
         if solution:
             # Ewaluacja
@@ -3,79 +3,188 @@ import numpy as np
 import pandas as pd
 from ortools.constraint_solver import pywrapcp
 from ortools.constraint_solver import routing_enums_pb2
-from ortools.constraint_solver import pywrapcp
-from matplotlib import pyplot as plt
-from src.solvers.solver_utils import create_data_model
-
-# Load the trained model
-model = joblib.load('traffic_delay_model_linear.pkl')
-
-def predict_delays(trips_df, time_df, traffic_df):
-    """
-    Predicts delays based on the given data and the trained model.
-    Adjusts the travel time matrix dynamically.
-    """
-    # Prepare the feature DataFrame for prediction
-    features = []
-    for i, row in trips_df.iterrows():
-        for j, col in trips_df.iterrows():
-            if i != j:  # Skip diagonal elements
-                feature = {
-                    'from_x': row['stop_lon'],
-                    'from_y': row['stop_lat'],
-                    'to_x': col['stop_lon'],
-                    'to_y': col['stop_lat'],
-                    'timestamp': 'morning',  # Use actual timestamp if available
-                    'traffic': traffic_df.loc[i, j] if not traffic_df.empty else 'moderate'  # Example traffic level
-                }
-                features.append(feature)
-
-    # Convert features to DataFrame
-    feature_df = pd.DataFrame(features)
-
-    # Perform one-hot encoding for categorical variables
-    feature_df = pd.get_dummies(feature_df, columns=['timestamp', 'traffic'], drop_first=True)
-
-    # Predict delays
-    delays = model.predict(feature_df)
-
-    # Update time matrix with predicted delays
-    adjusted_time_matrix = time_df.copy()
-    index = 0
-    for i in range(len(time_df)):
-        for j in range(len(time_df)):
-            if i != j:
-                adjusted_time_matrix[i][j] += delays[index]
-                index += 1
-
-    return adjusted_time_matrix
-
-def solve_vrp_with_predictions(time_csv, dist_csv, trips_file, traffic_csv=None):
+from src.solvers.solver_utils import create_data_model, print_solution, read_csv_cached
+
+MODEL_PATH = 'src/model/delay_prediction_model.pkl'
+ENCODER_PATH = 'src/model/time_of_day_encoder.pkl'
+
+# Traffic levels as encoded during training
+TRAFFIC_MAPPING = {'low': 1, 'moderate': 2, 'heavy': 3}
+TRAFFIC_LEVELS = tuple(TRAFFIC_MAPPING)
+DEFAULT_TRAFFIC = TRAFFIC_MAPPING['moderate']
+
+# Number of feature rows sent to the model in a single predict() call
+PREDICT_BATCH_SIZE = 50_000
+
+
+def load_model(model_path=MODEL_PATH, encoder_path=ENCODER_PATH):
     """
-    Solves the VRP problem, dynamically adjusting travel times using delay predictions.
+    Loads the delay prediction model and the 'time of day' encoder.
+    Loading is done on demand, so importing this module has no side effects.
     """
-    # Load data
-    time_df = pd.read_csv(time_csv, index_col=0)
-    trips_df = pd.read_csv(trips_file)
-    traffic_df = pd.read_csv(traffic_csv, index_col=0) if traffic_csv else pd.DataFrame()
+    model = joblib.load(model_path)
+    encoder = joblib.load(encoder_path)
+    return model, encoder
 
-    # Predict delays and adjust time matrix
-    adjusted_time_matrix = predict_delays(trips_df, time_df, traffic_df)
 
-    # Update the time_matrix in the data model
-    data = create_data_model(time_csv, dist_csv, trips_file)
-    data['time_matrix'] = adjusted_time_matrix.tolist()
+def departure_minutes(departure_times):
+    """
+    Converts departure times ('HH:MM' or 'HH:MM:SS', GTFS hours may exceed 24)
+    into minutes after midnight. Values that cannot be parsed count as 0.
+    """
+    parts = pd.Series(departure_times).astype(str).str.split(':', expand=True)
+    hours = pd.to_numeric(parts[0], errors='coerce')
+    # without any ':' the split returns a single column
+    minutes = pd.to_numeric(parts[1], errors='coerce') if 1 in parts.columns else 0
+    return (hours * 60 + minutes).fillna(0).to_numpy()
 
-    # Solve VRP using the adjusted time matrix
-    solve_vrp_core(data)
 
-def solve_vrp_core(data):
+def time_of_day(minutes):
     """
-    Core VRP solving logic (uses the adjusted time matrix from `data`).
+    Maps minutes after midnight onto the 'time of day' categories known to the encoder.
     """
-    trips_df = pd.read_csv(trips_file)
-    stop_names = trips_df['stop_name'].tolist()
+    hours = (np.asarray(minutes) // 60) % 24
+    return np.select([hours < 11, hours < 16], ['morning', 'midday'], 'evening')
+
+
+def align_traffic_matrix(traffic_df, time_df):
+    """
+    Joins a per-arc traffic matrix onto the travel time matrix.
+    Matrices with unique stop labels are aligned by label, otherwise by position.
+    Traffic levels may be given as names ('low', 'moderate', 'heavy') or as numbers;
+    empty cells default to 'moderate'.
+
+    Returns:
+    - numpy array of numerical traffic levels with the shape of the time matrix
+
+    Raises:
+    - ValueError: if the traffic labels do not cover the time matrix labels,
+      or the shapes differ for position-aligned matrices
+    """
+    if traffic_df is None or traffic_df.empty:
+        return np.full(time_df.shape, DEFAULT_TRAFFIC, dtype=float)
+
+    if time_df.index.is_unique and traffic_df.index.is_unique and traffic_df.columns.is_unique:
+        missing_rows = time_df.index.difference(traffic_df.index)
+        missing_cols = time_df.columns.difference(traffic_df.columns)
+        if len(missing_rows) or len(missing_cols):
+            missing = list(missing_rows[:3]) + list(missing_cols[:3])
+            raise ValueError(
+                f"Traffic matrix labels do not cover the time matrix, missing e.g.: {missing}"
+            )
+        traffic_df = traffic_df.reindex(index=time_df.index, columns=time_df.columns)
+    elif traffic_df.shape != time_df.shape:
+        raise ValueError(
+            f"Traffic matrix shape {traffic_df.shape} does not match time matrix shape {time_df.shape}!"
+        )
+
+    levels = traffic_df.to_numpy(dtype=object).ravel()
+    mapped = pd.Series(levels).map(lambda level: TRAFFIC_MAPPING.get(level, level) if isinstance(level, str) else level)
+    numeric = pd.to_numeric(mapped, errors='coerce').fillna(DEFAULT_TRAFFIC).to_numpy(dtype=float)
+    return numeric.reshape(time_df.shape)
+
+
+def predict_arc_delays(timestamps, traffic, model, encoder, batch_size=PREDICT_BATCH_SIZE):
+    """
+    Predicts delays for a batch of arcs.
+    The model only sees the time of day and the traffic level, so identical feature
+    rows are predicted once and broadcast back to every arc sharing them.
+
+    Parameters:
+    - timestamps: array with the 'time of day' category of each arc
+    - traffic: array with the numerical traffic level of each arc
+    - model: delay prediction model
+    - encoder: 'time of day' encoder
+    - batch_size: maximum number of rows per predict() call
+
+    Returns:
+    - numpy array of delays, one per arc
+    """
+    if len(timestamps) == 0:
+        return np.zeros(0)
+
+    feature_df = pd.DataFrame({'timestamp': timestamps, 'Traffic Level (Numerical)': traffic})
+    unique_df = feature_df.drop_duplicates().reset_index(drop=True)
+    unique_codes = pd.MultiIndex.from_frame(unique_df)
+    inverse = unique_codes.get_indexer(pd.MultiIndex.from_frame(feature_df))
+
+    delays = np.empty(len(unique_df))
+    for start in range(0, len(unique_df), batch_size):
+        batch = unique_df.iloc[start:start + batch_size]
+        time_of_day_encoded = encoder.transform(batch[['timestamp']])
+        X = np.hstack([time_of_day_encoded, batch[['Traffic Level (Numerical)']].values])
+        delays[start:start + batch_size] = model.predict(X)
+
+    return delays[inverse]
+
+
+def predict_delays(base_matrix, traffic_matrix, model, encoder, timestamp='morning', arcs=None,
+                   adjusted_matrix=None, batch_size=PREDICT_BATCH_SIZE):
+    """
+    Adjusts the travel time matrix with delays predicted for the given arcs.
+
+    Parameters:
+    - base_matrix: numpy array with travel times without delays
+    - traffic_matrix: numpy array with numerical traffic levels per arc
+    - model: delay prediction model
+    - encoder: 'time of day' encoder
+    - timestamp: 'time of day' category, a single value or one per arc
+    - arcs: tuple (from_nodes, to_nodes) of arcs to predict; all off-diagonal arcs if None
+    - adjusted_matrix: matrix to update in place; a copy of base_matrix if None
+    - batch_size: maximum number of rows per predict() call
+
+    Returns:
+    - adjusted travel time matrix (integer numpy array)
+    """
+    if adjusted_matrix is None:
+        adjusted_matrix = np.asarray(base_matrix, dtype=np.int64).copy()
+
+    if arcs is None:
+        rows, cols = np.nonzero(~np.eye(len(base_matrix), dtype=bool))
+    else:
+        rows, cols = (np.asarray(nodes, dtype=np.int64) for nodes in arcs)
+
+    timestamps = np.broadcast_to(np.asarray(timestamp, dtype=object), rows.shape)
+    delays = predict_arc_delays(timestamps, traffic_matrix[rows, cols], model, encoder, batch_size)
+    adjusted_matrix[rows, cols] = base_matrix[rows, cols] + np.rint(delays).astype(np.int64)
+    return adjusted_matrix
+
+
+def build_scenario_matrices(time_matrix, levels, model, encoder, timestamp='morning'):
+    """
+    Builds the delay-adjusted time matrix for every traffic level with a single model call.
+    The model only sees the time of day and the traffic level, so one feature row per
+    level gives the same delays as predicting every arc separately.
+
+    Parameters:
+    - time_matrix: travel time matrix without delays
+    - levels: traffic levels ('low', 'moderate', 'heavy')
+    - model: delay prediction model
+    - encoder: 'time of day' encoder
+    - timestamp: 'time of day' category
+
+    Returns:
+    - dict mapping each level to its adjusted time matrix (list of lists)
+    """
+    base_matrix = np.asarray(time_matrix, dtype=np.int64)
+    off_diagonal = ~np.eye(len(base_matrix), dtype=bool)
+
+    delays = predict_arc_delays(
+        np.full(len(levels), timestamp, dtype=object),
+        np.array([TRAFFIC_MAPPING[level] for level in levels]),
+        model, encoder
+    )
+
+    matrices = {}
+    for level, delay in zip(levels, np.rint(delays).astype(np.int64)):
+        matrices[level] = np.where(off_diagonal, base_matrix + delay, base_matrix).tolist()
+    return matrices
 
+
+def build_routing_model(data):
+    """
+    Builds the routing model minimizing the longest route for the travel times in `data`.
+    """
     manager = pywrapcp.RoutingIndexManager(
         data['num_locations'],
         data['num_vehicles'],
@@ -84,6 +193,7 @@ def solve_vrp_core(data):
     )
 
     routing = pywrapcp.RoutingModel(manager)
+    time_matrix = data['time_matrix']
 
     def time_callback(from_index, to_index):
         """
@@ -91,11 +201,11 @@ def solve_vrp_core(data):
         """
         from_node = manager.IndexToNode(from_index)
         to_node = manager.IndexToNode(to_index)
-        return data['time_matrix'][from_node][to_node]
+        return time_matrix[from_node][to_node]
 
     transit_callback_index = routing.RegisterTransitCallback(time_callback)
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
 
-    # Add dimensions and constraints as before
     routing.AddDimension(
         transit_callback_index,
         0,               # 0 slack time
@@ -103,11 +213,174 @@ def solve_vrp_core(data):
         True,            # start cumul to zero
         "Time"
     )
+    time_dimension = routing.GetDimensionOrDie("Time")
+    # Minimize the longest route
+    time_dimension.SetGlobalSpanCostCoefficient(100)
 
-    # Solve the problem as before
-    solution = routing.SolveWithParameters(search_parameters)
-    if solution:
-        route_nodes = print_solution(data, manager, routing, solution, stop_names)
-        plot_routes(route_nodes)
-    else:
+    # Avoid routes consisting only of the start and end stop
+    for vehicle_id in range(data['num_vehicles']):
+        routing.solver().Add(routing.NextVar(routing.Start(vehicle_id)) != routing.End(vehicle_id))
+
+    return manager, routing
+
+
+def solve_vrp_core(data, search_parameters, initial_routes=None):
+    """
+    Core VRP solving logic (uses the adjusted time matrix from `data`).
+    When `initial_routes` are given, the search is warm started from them.
+
+    Parameters:
+    - data: dict with the problem data
+    - search_parameters: routing search parameters
+    - initial_routes: list of node lists per vehicle, without the start and end nodes
+
+    Returns:
+    - (manager, routing, solution), solution is None if nothing was found
+
+    Raises:
+    - RuntimeError: if the initial routes cannot be loaded into the routing model
+    """
+    manager, routing = build_routing_model(data)
+
+    if initial_routes is None:
+        solution = routing.SolveWithParameters(search_parameters)
+        return manager, routing, solution
+
+    # ReadAssignmentFromRoutes expects routing variable indices, not node ids
+    routing.CloseModelWithParameters(search_parameters)
+    initial_solution = routing.ReadAssignmentFromRoutes(
+        [[manager.NodeToIndex(node) for node in route] for route in initial_routes], True
+    )
+    if initial_solution is None:
+        raise RuntimeError("Could not warm start the search from the previous routes.")
+    solution = routing.SolveFromAssignmentWithParameters(initial_solution, search_parameters)
+    return manager, routing, solution
+
+
+def extract_routes(data, manager, routing, solution):
+    """
+    Extracts the visited nodes and the arrival time at each of them for every vehicle.
+
+    Returns:
+    - routes: list of node lists (start and end included)
+    - arrivals: list of arrival time lists matching `routes`
+    """
+    time_dimension = routing.GetDimensionOrDie("Time")
+    routes, arrivals = [], []
+    for vehicle_id in range(data['num_vehicles']):
+        index = routing.Start(vehicle_id)
+        route, arrival = [], []
+        while True:
+            route.append(manager.IndexToNode(index))
+            arrival.append(solution.Value(time_dimension.CumulVar(index)))
+            if routing.IsEnd(index):
+                break
+            index = solution.Value(routing.NextVar(index))
+        routes.append(route)
+        arrivals.append(arrival)
+    return routes, arrivals
+
+
+def route_arcs(data, routes, arrivals, start_minutes):
+    """
+    Lists the arcs used by the routes together with the 'time of day' at which each one is entered.
+
+    Returns:
+    - (from_nodes, to_nodes, timestamps) numpy arrays
+    """
+    from_nodes, to_nodes, minutes = [], [], []
+    for vehicle_id, (route, arrival) in enumerate(zip(routes, arrivals)):
+        departure = start_minutes[data['starts'][vehicle_id]]
+        from_nodes.extend(route[:-1])
+        to_nodes.extend(route[1:])
+        minutes.extend(departure + np.asarray(arrival[:-1]))
+    return np.asarray(from_nodes), np.asarray(to_nodes), time_of_day(minutes)
+
+
+def solve_vrp_with_predictions(time_csv, trips_file, traffic_csv=None, model=None, encoder=None,
+                               rounds=1, time_limit=60, batch_size=PREDICT_BATCH_SIZE):
+    """
+    Solves the VRP problem, dynamically adjusting travel times using delay predictions.
+
+    Delays for all arcs are first predicted in batches for the morning peak, using the
+    per-arc traffic levels from `traffic_csv`. With `rounds` > 1, each further round
+    re-predicts only the arcs used by the current routes, using the time of day
+    at which the vehicle enters them, and re-solves warm started from those routes.
+    Rounds stop early once the routes no longer change. Each round uses a different
+    matrix, so the objectives of rounds are not comparable; the routes of the last
+    solved round are returned, together with the travel times of its matrix.
+
+    Parameters:
+    - time_csv: path to the travel time matrix CSV
+    - trips_file: path to the CSV with stop information
+    - traffic_csv: path to the per-arc traffic level matrix CSV (optional)
+    - model, encoder: delay prediction model and encoder; loaded from disk if None
+    - rounds: number of search rounds
+    - time_limit: search time limit per round in seconds
+    - batch_size: maximum number of rows per predict() call
+
+    Returns:
+    - route_nodes: dict with stop coordinates for each route, None if no solution was found
+    """
+    if model is None or encoder is None:
+        model, encoder = load_model()
+
+    time_df = read_csv_cached(time_csv, index_col=0)
+    trips_df = read_csv_cached(trips_file)
+    traffic_df = read_csv_cached(traffic_csv, index_col=0) if traffic_csv else None
+    # every trip row is a routing node and needs its own row and column in the matrix
+    if time_df.shape != (len(trips_df), len(trips_df)):
+        raise ValueError(
+            f"Time matrix shape {time_df.shape} does not match the {len(trips_df)} stops "
+            f"in {trips_file}; expected a {len(trips_df)}x{len(trips_df)} matrix."
+        )
+    stop_names = trips_df['stop_name'].tolist()
+
+    base_matrix = time_df.to_numpy(dtype=np.int64)
+    traffic_matrix = align_traffic_matrix(traffic_df, time_df)
+    start_minutes = departure_minutes(trips_df['departure_time']) if 'departure_time' in trips_df else np.zeros(len(trips_df))
+
+    # Predict delays for all arcs and update the data model
+    adjusted_matrix = predict_delays(base_matrix, traffic_matrix, model, encoder, batch_size=batch_size)
+    data = create_data_model(time_csv, trips_file)
+    data['time_matrix'] = adjusted_matrix.tolist()
+
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+    search_parameters.first_solution_strategy = (
+        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+    )
+    search_parameters.local_search_metaheuristic = (
+        routing_enums_pb2.LocalSearchMetaheuristic.SIMULATED_ANNEALING
+    )
+    search_parameters.time_limit.seconds = time_limit
+
+    last_round = None
+    last_routes = None
+    for round_id in range(max(1, rounds)):
+        # Solver routes exclude the start and end nodes
+        initial_routes = [route[1:-1] for route in last_routes] if last_routes else None
+        manager, routing, solution = solve_vrp_core(data, search_parameters, initial_routes)
+        if solution is None:
+            break
+
+        last_round = (manager, routing, solution, data['time_matrix'])
+        routes, arrivals = extract_routes(data, manager, routing, solution)
+        if routes == last_routes:
+            break
+        last_routes = routes
+
+        if round_id + 1 < rounds:
+            # Re-predict only the arcs used by the current routes
+            from_nodes, to_nodes, timestamps = route_arcs(data, routes, arrivals, start_minutes)
+            predict_delays(
+                base_matrix, traffic_matrix, model, encoder, timestamp=timestamps,
+                arcs=(from_nodes, to_nodes), adjusted_matrix=adjusted_matrix, batch_size=batch_size
+            )
+            data['time_matrix'] = adjusted_matrix.tolist()
+
+    if last_round is None:
         print("Nie znaleziono rozwiązania.")
+        return None
+
+    manager, routing, solution, data['time_matrix'] = last_round
+    return print_solution(data, manager, routing, solution, stop_names)
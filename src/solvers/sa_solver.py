@@ -1,9 +1,15 @@
 from ortools.constraint_solver import pywrapcp, routing_enums_pb2
-from .solver_utils import create_data_model, print_solution, predict_delays
+from .solver_utils import (
+    create_data_model, print_solution, read_csv_cached,
+    adaptive_time_limit, ConvergenceMonitor, max_route_time_objective
+)
+from .ml_sa_solver import build_scenario_matrices
 import pandas as pd
 import numpy as np
 
-def solve_vrp_sa(time_csv, trips_file, traffic_level=None, model=None, encoder=None):
+def solve_vrp_sa(time_csv, trips_file, traffic_level=None, model=None, encoder=None,
+                 adaptive=False, stall_seconds=None, min_improvement=0.0, max_time_limit=None,
+                 time_matrix=None, with_route_times=False):
     """
     Rozwiązuje problem Vehicle Routing Problem z użyciem Google OR-Tools z Simulated Annealing.
     Uwzlędnia opóźnienie jeżeli pliki traffic_csv, model i encoder są podane.
@@ -13,17 +19,26 @@ def solve_vrp_sa(time_csv, trips_file, traffic_level=None, model=None, encoder=N
     traffic_level - poziom matęzienia ruchu ('low', 'moderate', 'heavy')
     model - model predykcji opóźnienia
     encoder - encoder czasu
+    adaptive - limit czasu zależny od rozmiaru instancji i zatrzymanie po braku poprawy celu
+    stall_seconds - okno czasu bez poprawy celu (domyślnie 10% limitu czasu, min. 1 s)
+    min_improvement - minimalna względna poprawa celu uznawana za poprawę
+    max_time_limit - górne ograniczenie limitu czasu w sekundach (opcjonalne)
+    time_matrix - gotowa macierz czasu (np. z opóźnieniami), zastępuje macierz z time_csv
+    with_route_times - zwraca dodatkowo czasy tras poszczególnych pojazdów
 
     Zwraca:
     route_nodes - lista wierzchołków trasy
+    route_times - dict z czasem trasy dla każdego pojazdu (tylko gdy with_route_times)
     """
-    trips_df = pd.read_csv(trips_file)
+    trips_df = read_csv_cached(trips_file)
     stop_names = trips_df['stop_name'].tolist()  #
 
     data = create_data_model(time_csv, trips_file)
 
-    if traffic_level and model and encoder:
-        data['time_matrix'] = predict_delays(trips_df, data['time_matrix'], traffic_level, model, encoder)    
+    if time_matrix is not None:
+        data['time_matrix'] = [list(row) for row in time_matrix]
+    elif traffic_level and model and encoder:
+        data['time_matrix'] = build_scenario_matrices(data['time_matrix'], [traffic_level], model, encoder)[traffic_level]
 
     manager = pywrapcp.RoutingIndexManager(
         data['num_locations'],
@@ -119,14 +134,36 @@ def solve_vrp_sa(time_csv, trips_file, traffic_level=None, model=None, encoder=N
     search_parameters.local_search_metaheuristic = (
         routing_enums_pb2.LocalSearchMetaheuristic.SIMULATED_ANNEALING
     )
-    search_parameters.time_limit.seconds = 60
+    time_limit = 60
+    if adaptive:
+        time_limit = adaptive_time_limit(data['num_locations'], data['num_vehicles'])
+    if max_time_limit is not None:
+        time_limit = max(1, min(time_limit, int(max_time_limit)))
+    monitor = None
+    if adaptive:
+        if stall_seconds is None:
+            stall_seconds = max(1, time_limit // 10)
+        monitor = ConvergenceMonitor(
+            routing, max_route_time_objective(data, routing), stall_seconds, min_improvement
+        )
+    search_parameters.time_limit.seconds = time_limit
     search_parameters.log_search = True
 
     # Rozwiązanie problemu
+    if monitor is not None:
+        monitor.reset()
     solution = routing.SolveWithParameters(search_parameters)
+    if monitor is not None:
+        print(f"Zakończenie wyszukiwania: {monitor.stop_reason(time_limit)}")
     if solution:
         route_nodes = print_solution(data, manager, routing, solution, stop_names)
+        if with_route_times:
+            route_times = {
+                f"Pojazd {vehicle_id + 1}": solution.Value(time_dimension.CumulVar(routing.End(vehicle_id)))
+                for vehicle_id in range(data['num_vehicles'])
+            }
+            return route_nodes, route_times
         return route_nodes
     else:
         print("Nie znaleziono rozwiązania.")
-        return None
+        return (None, None) if with_route_times else None
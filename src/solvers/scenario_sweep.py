@@ -0,0 +1,91 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from src.solvers.ml_sa_solver import TRAFFIC_LEVELS, build_scenario_matrices
+from src.solvers.sa_solver import solve_vrp_sa
+from src.solvers.solver_utils import create_data_model, read_csv_cached
+
+# Shared base instance of the worker processes, filled in by _init_worker()
+_base = {}
+
+
+def _init_worker(time_csv, trips_file, matrices):
+    """
+    Stores the shared base instance in the worker process.
+    """
+    _base.update(time_csv=time_csv, trips_file=trips_file, matrices=matrices)
+    # warms the CSV cache unless it was already inherited from the parent process
+    create_data_model(time_csv, trips_file)
+
+
+def _solve_scenario(level, adaptive):
+    route_nodes, route_times = solve_vrp_sa(
+        _base['time_csv'], _base['trips_file'],
+        time_matrix=_base['matrices'][level],
+        adaptive=adaptive,
+        with_route_times=True
+    )
+    return level, route_nodes, route_times
+
+
+def compare_scenarios(route_times):
+    """
+    Builds the comparison table of route times across traffic levels.
+
+    Parameters:
+    - route_times: dict mapping each level to a dict of per-vehicle route times,
+      None for levels without a solution
+
+    Returns:
+    - DataFrame with one row per vehicle plus the maximum route time, one column per level;
+      unsolved levels are kept as empty (<NA>) columns, with only the 'Max' row if no level was solved
+    """
+    table = pd.DataFrame({
+        level: pd.Series(times if times is not None else {}, dtype='Int64')
+        for level, times in route_times.items()
+    })
+    max_row = table.max().to_frame('Max').T.astype('Int64')
+    table = pd.concat([table, max_row])
+    table.index.name = 'vehicle'
+    return table
+
+
+def solve_traffic_scenarios(time_csv, trips_file, model, encoder, levels=TRAFFIC_LEVELS,
+                            adaptive=False, workers=None):
+    """
+    Solves the VRP problem for several traffic levels in parallel and compares route times.
+
+    Parameters:
+    - time_csv: path to the travel time matrix CSV
+    - trips_file: path to the CSV with stop information
+    - model: delay prediction model
+    - encoder: 'time of day' encoder
+    - levels: traffic levels to compare
+    - adaptive: adaptive time limit with early stopping for each scenario
+    - workers: number of worker processes, one per level by default
+
+    Returns:
+    - route_nodes: dict mapping each level to its route coordinates (None if unsolved)
+    - table: DataFrame with per-vehicle and max route times for each level
+    """
+    levels = list(levels)
+    time_df = read_csv_cached(time_csv, index_col=0)
+    # parse the trips file before forking so the workers inherit the cached base instance
+    create_data_model(time_csv, trips_file)
+    matrices = build_scenario_matrices(time_df.values, levels, model, encoder)
+
+    workers = workers or min(len(levels), os.cpu_count() or 1)
+    route_nodes, route_times = {}, {}
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(time_csv, trips_file, matrices),
+    ) as executor:
+        futures = [executor.submit(_solve_scenario, level, adaptive) for level in levels]
+        for future in futures:
+            level, nodes, times = future.result()
+            route_nodes[level] = nodes
+            route_times[level] = times
+
+    return route_nodes, compare_scenarios(route_times)
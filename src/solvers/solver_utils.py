@@ -1,6 +1,18 @@
-import joblib
+import os
+import time
+from functools import lru_cache
 import pandas as pd
-import numpy as np
+
+@lru_cache(maxsize=32)
+def _read_csv(path, mtime, index_col):
+    return pd.read_csv(path, index_col=index_col)
+
+def read_csv_cached(path, index_col=None):
+    """
+    Wczytuje plik CSV, zapamiętując wynik do czasu modyfikacji pliku.
+    Zwrócony DataFrame jest współdzielony i nie powinien być modyfikowany.
+    """
+    return _read_csv(path, os.path.getmtime(path), index_col)
 
 def create_data_model(time_csv, trips_file):
     """
@@ -13,8 +25,8 @@ def create_data_model(time_csv, trips_file):
     Zwraca:
     - data: dict zawierajacy dynamiczne dane
     """
-    time_df = pd.read_csv(time_csv, index_col=0)
-    trips_df = pd.read_csv(trips_file)
+    time_df = read_csv_cached(time_csv, index_col=0)
+    trips_df = read_csv_cached(trips_file)
 
     data = {}
     data['time_matrix'] = time_df.values.tolist()
@@ -101,59 +113,114 @@ def print_solution(data, manager, routing, solution, stop_names):
     print(f"\nSumaryczny czas podróży: {total_time} min.")
     return route_nodes
 
-# ładuje model i encoder
-model = joblib.load('src/RFR model/delay_prediction_model.pkl')
-encoder = joblib.load('src/RFR model/time_of_day_encoder.pkl')
-
-# mapowanie natężenia ruchu z uczenia
-traffic_mapping = {'low': 1, 'moderate': 2, 'heavy': 3}
+# parametry adaptacyjnego limitu czasu
+ADAPTIVE_MIN_SECONDS = 2
+ADAPTIVE_MAX_SECONDS = 60
+ADAPTIVE_SECONDS_PER_LOCATION = 0.5
 
-def predict_delays(trips_df, time_matrix, traffic_level, model, encoder):
+def adaptive_time_limit(num_locations, num_vehicles,
+                        min_seconds=ADAPTIVE_MIN_SECONDS,
+                        max_seconds=ADAPTIVE_MAX_SECONDS,
+                        seconds_per_location=ADAPTIVE_SECONDS_PER_LOCATION):
     """
-    Przewiduje opóźnienie na podstawie danych i ruchu.
-    Dynamicznie dopasowuje macierz czasu.
-    
+    Wyznacza limit czasu wyszukiwania na podstawie rozmiaru instancji.
+
     Parametry:
-    - trips_df: DataFrame zawierający informacje o trasach.
-    - time_matrix: Macierz czasu.
-    - traffic_level: Poziom matężenia ruchu ('low', 'moderate', 'heavy').
-    - model: Model predykcji opóźnienia.
-    - encoder: Encoder czasu.
+    - num_locations: liczba przystanków
+    - num_vehicles: liczba pojazdów
+    - min_seconds, max_seconds: dolne i górne ograniczenie limitu
+    - seconds_per_location: czas przypadający na jeden przystanek
 
     Zwraca:
-    - Nowa macierz czasu z opóźnieniami w zależności od natężenia ruchu.
+    - limit czasu w sekundach (int)
+    """
+    # każdy dodatkowy pojazd zwiększa liczbę możliwych przypisań przystanków
+    size = num_locations * (1 + 0.1 * max(num_vehicles - 1, 0))
+    return int(min(max_seconds, max(min_seconds, round(seconds_per_location * size))))
+
+
+class ConvergenceMonitor:
     """
+    Zatrzymuje wyszukiwanie, gdy wartość celu nie poprawiła się przez stall_seconds sekund.
+    Poprawa mniejsza niż min_improvement (względnie do najlepszej wartości) nie jest liczona.
+    Okno jest sprawdzane przez limit wyszukiwania (CustomLimit), który solver odpytuje
+    okresowo, także gdy nie znajduje nowych rozwiązań. Odliczanie zaczyna się od pierwszego
+    znalezionego rozwiązania, chyba że reset(armed=True) uzbroi je od startu wyszukiwania.
+    Po zakończeniu wyszukiwania stop_reason opisuje przyczynę zatrzymania.
+
+    Parametry:
+    - routing: objekt RoutingModel
+    - objective: funkcja zwracająca wartość celu dla bieżącego rozwiązania
+    - stall_seconds: okno czasu bez poprawy
+    - min_improvement: minimalna względna poprawa celu
+    """
+
+    def __init__(self, routing, objective, stall_seconds, min_improvement=0.0):
+        self.routing = routing
+        self.objective = objective
+        self.stall_seconds = stall_seconds
+        self.min_improvement = min_improvement
+        self.reset()
+        routing.AddAtSolutionCallback(self.on_solution)
+        # referencja do limitu musi żyć tak długo jak model
+        self.limit = routing.solver().CustomLimit(self.stalled)
+        routing.AddSearchMonitor(self.limit)
+
+    def reset(self, armed=False):
+        """
+        Przygotowuje monitor do kolejnego uruchomienia wyszukiwania.
+
+        Parametry:
+        - armed: okno liczone od startu wyszukiwania, także bez żadnego rozwiązania
+          (np. gdy istnieje już rozwiązanie z poprzedniego przebiegu)
+        """
+        self.armed = armed
+        self.best_objective = None
+        self.stopped = False
+        self.started_at = time.monotonic()
+        self.last_improvement_at = self.started_at
+
+    def on_solution(self):
+        value = self.objective()
+        if self.best_objective is None or value < self.best_objective * (1 - self.min_improvement):
+            self.best_objective = value
+            self.last_improvement_at = time.monotonic()
+        elif value < self.best_objective:
+            self.best_objective = value
+
+    def stalled(self):
+        """
+        Zwraca True, gdy od ostatniej poprawy celu minęło stall_seconds sekund.
+        """
+        if not self.stopped and (self.armed or self.best_objective is not None):
+            self.stopped = time.monotonic() - self.last_improvement_at >= self.stall_seconds
+        return self.stopped
+
+    def stop_reason(self, time_limit):
+        """
+        Zwraca opis przyczyny zakończenia wyszukiwania.
+        """
+        elapsed = time.monotonic() - self.started_at
+        if self.stopped:
+            best = self.best_objective if self.best_objective is not None else "brak rozwiązania"
+            return (f"brak poprawy celu przez {self.stall_seconds} s "
+                    f"(najlepszy: {best}, czas: {elapsed:.1f} s)")
+        # solver mierzy czas od własnego startu, stąd niewielka tolerancja
+        if elapsed >= time_limit - 0.1:
+            return f"osiągnięto limit czasu {round(time_limit, 1):g} s"
+        return f"wyszukiwanie zakończone przez solver (czas: {elapsed:.1f} s)"
+
+
+def max_route_time_objective(data, routing):
+    """
+    Zwraca funkcję obliczającą najdłuższy czas trasy dla bieżącego rozwiązania.
+    """
+    time_dimension = routing.GetDimensionOrDie("Time")
+
+    def objective():
+        return max(
+            time_dimension.CumulVar(routing.End(vehicle_id)).Min()
+            for vehicle_id in range(data['num_vehicles'])
+        )
 
-    # mapowanie ruchu
-    traffic_mapping = {'low': 1, 'moderate': 2, 'heavy': 3}
-    
-    features = []
-    for i, row in trips_df.iterrows():
-        for j, col in trips_df.iterrows():
-            if i != j:  
-                feature = {
-                    'from_x': row['stop_lon'],
-                    'from_y': row['stop_lat'],
-                    'to_x': col['stop_lon'],
-                    'to_y': col['stop_lat'],
-                    'timestamp': 'morning',  
-                    'traffic': traffic_mapping[traffic_level]  
-                }
-                features.append(feature)
-
-    feature_df = pd.DataFrame(features)
-    feature_df['Traffic Level (Numerical)'] = feature_df['traffic']
-    time_of_day_encoded = encoder.transform(feature_df[['timestamp']])
-    X = np.hstack([time_of_day_encoded, feature_df[['Traffic Level (Numerical)']].values])
-    delays = model.predict(X)
-
-    # obliczenie nowej macierzy czasu
-    adjusted_time_matrix = time_matrix.copy()
-    index = 0
-    for i in range(len(time_matrix)):
-        for j in range(len(time_matrix)):
-            if i != j:
-                adjusted_time_matrix[i][j] += int(round(delays[index]))
-                index += 1
-
-    return adjusted_time_matrix
+    return objective
@@ -1,7 +1,40 @@
+from functools import lru_cache
 import osmnx as ox
 import matplotlib.pyplot as plt
 import networkx as nx
 
+@lru_cache(maxsize=4)
+def load_graph(location="Marzahn-Hellersdorf, Berlin, Germany"):
+    """
+    Downloads the drivable road network for a location.
+    Graphs are cached, so repeated calls for the same location reuse the graph in memory.
+
+    Parameters:
+    - location (str): Area to download.
+
+    Returns:
+    - networkx.MultiDiGraph: Road network graph.
+    """
+    return ox.graph_from_place(location, network_type="drive")
+
+def nearest_route_nodes(G, route_nodes):
+    """
+    Finds the nearest OSM node for the coordinates of each stop.
+
+    Parameters:
+    - G (networkx.MultiDiGraph): Road network graph.
+    - route_nodes (dict): Dictionary with vehicle routes and coordinates.
+
+    Returns:
+    - dict: Dictionary with vehicle routes and OSM node ids.
+    """
+    node_routes = {}
+    for vehicle, coordinates in route_nodes.items():
+        lats = [lat for lat, lon in coordinates]
+        lons = [lon for lat, lon in coordinates]
+        node_routes[vehicle] = [int(node) for node in ox.distance.nearest_nodes(G, lons, lats)]
+    return node_routes
+
 def plot_routes(route_nodes, location="Marzahn-Hellersdorf, Berlin, Germany"):
     """
     Plots routes on a street map using the OSMnx library.
@@ -17,14 +50,10 @@ def plot_routes(route_nodes, location="Marzahn-Hellersdorf, Berlin, Germany"):
     """
     
     # Get a map for a specific location, road network
-    G = ox.graph_from_place(location, network_type="drive")
+    G = load_graph(location)
 
     # Find the nearest OSM node for the coordinates of each stop
-    node_routes = {}
-    for vehicle, coordinates in route_nodes.items():
-        node_routes[vehicle] = [
-            ox.distance.nearest_nodes(G, lon, lat) for lat, lon in coordinates
-        ]
+    node_routes = nearest_route_nodes(G, route_nodes)
 
     # Prepare the graph with vehicle routes
     fig, ax = ox.plot_graph(G, show=False, close=False) 
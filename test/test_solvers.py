@@ -0,0 +1,192 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("ortools")
+
+from src.solvers.ml_sa_solver import (
+    TRAFFIC_MAPPING, align_traffic_matrix, build_scenario_matrices, departure_minutes,
+    predict_arc_delays, predict_delays, solve_vrp_with_predictions
+)
+from src.solvers.scenario_sweep import compare_scenarios
+from src.solvers.solver_utils import ConvergenceMonitor, adaptive_time_limit
+from src.service import parse_job
+
+SYNTHETIC_TIME_CSV = "test/synthetic data/test_time_matrix.csv"
+SYNTHETIC_TRIPS_FILE = "test/synthetic data/test_Trips_with_Stops_and_Departures.csv"
+
+
+class FakeEncoder:
+    """One-hot encoder over the 'time of day' categories known to the real encoder."""
+    categories = ['evening', 'midday', 'morning']
+
+    def transform(self, df):
+        return np.array([[float(value == category) for category in self.categories]
+                         for value in df['timestamp']])
+
+
+class FakeModel:
+    """Delay = 10 * traffic level + index of the 'time of day' category; counts predicted rows."""
+
+    def __init__(self):
+        self.rows = 0
+
+    def predict(self, X):
+        self.rows += len(X)
+        return 10 * X[:, -1] + X[:, :-1].argmax(axis=1)
+
+
+class FakeRouting:
+    """Records the callbacks ConvergenceMonitor registers on the routing model."""
+
+    def AddAtSolutionCallback(self, callback):
+        self.on_solution = callback
+
+    def solver(self):
+        return self
+
+    def CustomLimit(self, callback):
+        return callback
+
+    def AddSearchMonitor(self, monitor):
+        self.limit = monitor
+
+
+def make_time_df(labels):
+    return pd.DataFrame(np.ones((len(labels), len(labels)), dtype=int), index=labels, columns=labels)
+
+
+def test_align_traffic_matrix_by_label():
+    time_df = make_time_df(['A', 'B'])
+    traffic_df = pd.DataFrame([['heavy', None], [1, 'low']], index=['B', 'A'], columns=['B', 'A'])
+
+    traffic = align_traffic_matrix(traffic_df, time_df)
+
+    # reordered to the time matrix labels, the empty cell defaults to 'moderate'
+    np.testing.assert_array_equal(traffic, [[1, 1], [2, 3]])
+
+
+def test_align_traffic_matrix_rejects_unmatched_labels():
+    time_df = make_time_df(['A', 'B'])
+    traffic_df = pd.DataFrame([['low', 'low'], ['low', 'low']], index=[0, 1], columns=['0', '1'])
+
+    with pytest.raises(ValueError, match="do not cover"):
+        align_traffic_matrix(traffic_df, time_df)
+
+
+def test_align_traffic_matrix_without_traffic_is_moderate():
+    traffic = align_traffic_matrix(None, make_time_df(['A', 'B', 'C']))
+
+    np.testing.assert_array_equal(traffic, np.full((3, 3), 2))
+
+
+def test_departure_minutes():
+    np.testing.assert_array_equal(departure_minutes(['08:05', '25:10:00', None]), [485, 1510, 0])
+    # no value contains ':' at all
+    np.testing.assert_array_equal(departure_minutes([np.nan, np.nan]), [0, 0])
+    np.testing.assert_array_equal(departure_minutes([7, 8]), [420, 480])
+
+
+def test_predict_arc_delays_deduplicates_and_broadcasts_back():
+    model = FakeModel()
+    timestamps = np.array(['morning', 'evening', 'morning', 'morning', 'evening'], dtype=object)
+    traffic = np.array([1, 3, 1, 2, 3])
+
+    delays = predict_arc_delays(timestamps, traffic, model, FakeEncoder(), batch_size=2)
+
+    np.testing.assert_array_equal(delays, [12, 30, 12, 22, 30])
+    assert model.rows == 3
+
+
+def test_solve_with_predictions_rejects_mismatched_matrix():
+    # 33 trip rows against a 20x20 matrix
+    with pytest.raises(ValueError, match="does not match"):
+        solve_vrp_with_predictions(SYNTHETIC_TIME_CSV, SYNTHETIC_TRIPS_FILE, model=FakeModel(), encoder=FakeEncoder())
+
+
+def test_adaptive_time_limit_scales_with_instance_size():
+    assert adaptive_time_limit(2, 1) == 2
+    assert adaptive_time_limit(26, 3) == 16
+    assert adaptive_time_limit(10_000, 50) == 60
+    assert adaptive_time_limit(26, 1) < adaptive_time_limit(26, 3)
+
+
+def test_convergence_monitor_waits_for_first_solution():
+    routing = FakeRouting()
+    monitor = ConvergenceMonitor(routing, objective=lambda: 10, stall_seconds=0)
+
+    assert not routing.limit()
+    routing.on_solution()
+    assert routing.limit()
+    assert "brak poprawy" in monitor.stop_reason(60)
+
+
+def test_convergence_monitor_armed_stops_without_solution():
+    routing = FakeRouting()
+    monitor = ConvergenceMonitor(routing, objective=lambda: 10, stall_seconds=0)
+
+    monitor.reset(armed=True)
+
+    assert routing.limit()
+
+
+def test_parse_job_defaults():
+    job = parse_job({'time_csv': SYNTHETIC_TIME_CSV, 'trips_file': SYNTHETIC_TRIPS_FILE}, default_deadline=30)
+
+    assert job['algorithm'] == 'sa'
+    assert job['adaptive'] is True
+    assert job['osm_nodes'] is False
+    assert job['rounds'] == 1
+    assert job['deadline'] == 30
+
+
+@pytest.mark.parametrize("overrides, message", [
+    ({'algorithm': 'genetic'}, "Unknown algorithm"),
+    ({'time_csv': 'missing.csv'}, "File not found"),
+    ({'algorithm': 'sa_delay'}, "traffic_level"),
+    ({'rounds': 0}, "rounds"),
+    ({'rounds': True}, "rounds"),
+    ({'deadline': -1}, "deadline"),
+    ({'adaptive': 'false'}, "adaptive"),
+    ({'osm_nodes': 1}, "osm_nodes"),
+])
+def test_parse_job_rejects_invalid_requests(overrides, message):
+    payload = {'time_csv': SYNTHETIC_TIME_CSV, 'trips_file': SYNTHETIC_TRIPS_FILE, **overrides}
+
+    with pytest.raises(ValueError, match=message):
+        parse_job(payload)
+
+
+def test_build_scenario_matrices_matches_per_arc_prediction():
+    base_matrix = np.arange(16).reshape(4, 4) * (1 - np.eye(4, dtype=int))
+    model = FakeModel()
+
+    matrices = build_scenario_matrices(base_matrix, ['low', 'heavy'], model, FakeEncoder())
+
+    assert model.rows == 2
+    for level, matrix in matrices.items():
+        traffic_matrix = np.full(base_matrix.shape, TRAFFIC_MAPPING[level])
+        expected = predict_delays(base_matrix, traffic_matrix, FakeModel(), FakeEncoder())
+        np.testing.assert_array_equal(matrix, expected)
+        np.testing.assert_array_equal(np.diagonal(matrix), 0)
+
+
+def test_compare_scenarios_keeps_unsolved_levels():
+    table = compare_scenarios({
+        'low': {'Pojazd 1': 5, 'Pojazd 2': 21},
+        'moderate': None,
+        'heavy': {'Pojazd 1': 35, 'Pojazd 2': 51},
+    })
+
+    assert list(table.columns) == ['low', 'moderate', 'heavy']
+    assert list(table.index) == ['Pojazd 1', 'Pojazd 2', 'Max']
+    assert table.loc['Max', 'low'] == 21
+    assert table.loc['Max', 'heavy'] == 51
+    assert table['moderate'].isna().all()
+
+
+def test_compare_scenarios_all_unsolved():
+    table = compare_scenarios({'low': None, 'heavy': None})
+
+    assert list(table.index) == ['Max']
+    assert table.isna().all().all()